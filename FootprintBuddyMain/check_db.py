@@ -1,29 +1,95 @@
 # check_db.py
-import sqlite3, json, os
+import sqlite3, os, sys
+from pathlib import Path
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, "users.db")  # users.db next to check_db.py
 
-print("DB path:", DB_PATH, "| exists:", os.path.exists(DB_PATH))
+# No ORDER BY: users is a WITHOUT ROWID table keyed by username, so a scan already returns username order.
+# Current schema: the hashing scheme is a typed column
+TYPED_SQL = """
+SELECT username, length(hash) AS plen,
+       CASE kdf WHEN 'pbkdf2_sha256' THEN 'PBKDF2'
+                WHEN 'sha256' THEN 'LEGACY_SHA256'
+                ELSE upper(kdf) END AS kind
+FROM users;
+"""
+# Databases not yet migrated by the app (text password column):
+# classify each stored password inside SQLite (JSON1) so no blob is parsed in Python.
+CLASSIFY_SQL = """
+SELECT username, length(password) AS plen,
+       CASE WHEN password LIKE '$argon2%' THEN 'ARGON2'
+            WHEN json_valid(password)
+                 AND json_extract(password, '$.kdf') = 'scrypt' THEN 'SCRYPT'
+            WHEN json_valid(password)
+                 AND json_type(password, '$.hash') IS NOT NULL
+                 AND json_type(password, '$.salt') IS NOT NULL
+            THEN 'PBKDF2' ELSE 'LEGACY_SHA256' END AS kind
+FROM users;
+"""
+# Used only when SQLite was built without JSON1: same columns, classified by substring scans
+FALLBACK_SQL = """
+SELECT username, length(password) AS plen,
+       CASE WHEN password LIKE '$argon2%' THEN 'ARGON2'
+            WHEN ltrim(password, char(32, 9, 10, 13)) LIKE '{%'
+                 AND instr(password, '"kdf": "scrypt"') > 0 THEN 'SCRYPT'
+            WHEN ltrim(password, char(32, 9, 10, 13)) LIKE '{%'
+                 AND instr(password, '"hash"') > 0
+                 AND instr(password, '"salt"') > 0
+            THEN 'PBKDF2' ELSE 'LEGACY_SHA256' END AS kind
+FROM users;
+"""
 
-conn = sqlite3.connect(DB_PATH)
+# Read-only diagnostic: bigger page cache, in-memory temp storage, and mmap'd page reads.
+# journal_mode is persistent per database and already set to WAL by main.py's init_db().
+READ_PRAGMAS = (
+    "query_only=1",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "cache_size=-64000",
+    "mmap_size=268435456",
+)
+
+db_exists = os.path.exists(DB_PATH)
+print("DB path:", DB_PATH, "| exists:", db_exists)
+if not db_exists:
+    print("Database not found; run the app once to create it.")
+    sys.exit(1)
+
+# Open read-only so the check never takes write locks or creates a database.
+# Not immutable=1: the app runs in WAL mode and recent signups may still live in users.db-wal.
+conn = sqlite3.connect(f"{Path(DB_PATH).as_uri()}?mode=ro", uri=True)
+conn.row_factory = sqlite3.Row  # C-level rows, columns accessed by name
 cur = conn.cursor()
+for p in READ_PRAGMAS:
+    cur.execute(f"PRAGMA {p};")
+
+print("Tables:", [r["name"] for r in cur.execute("SELECT name FROM sqlite_master WHERE type='table';")])
 
-print("Tables:", cur.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall())
+try:
+    cur.execute("SELECT json_valid('{}');")
+    has_json1 = True
+except sqlite3.OperationalError:
+    has_json1 = False
+
+user_cols = {r["name"] for r in cur.execute("PRAGMA table_info(users);")}
+if "kdf" in user_cols:
+    query = TYPED_SQL
+else:
+    query = CLASSIFY_SQL if has_json1 else FALLBACK_SQL
 
 try:
-    rows = cur.execute("SELECT id, username, password FROM users ORDER BY id;").fetchall()
-    print(f"Total users: {len(rows)}")
-    for user_id, username, blob in rows:
-        kind = "PBKDF2"
-        try:
-            rec = json.loads(blob)
-            if not isinstance(rec, dict) or "hash" not in rec or "salt" not in rec:
-                kind = "LEGACY_SHA256"
-        except Exception:
-            kind = "LEGACY_SHA256"
-        print(f"- {user_id}: {username} [{kind}] (password length={len(blob)})")
+    total = cur.execute("SELECT COUNT(*) FROM users;").fetchone()[0]
+    print(f"Total users: {total}")
+
+    # Stream rows in fixed-size batches instead of materializing the whole table
+    cur.arraysize = 1000
+    cur.execute(query)
+    fmt = "- {username} [{kind}] (stored length={plen})".format_map  # bound once, fed sqlite3.Row
+    # One write per batch instead of one print() per user; memory stays at one batch
+    while (batch := cur.fetchmany()):
+        sys.stdout.write("".join(f"{line}\n" for line in map(fmt, batch)))
 except sqlite3.OperationalError as e:
     print("DB error:", e)
 
-conn.close()
\ No newline at end of file
+conn.close()
@@ -5,8 +5,18 @@ import hashlib
 import base64
 import sqlite3
 import plotly.graph_objects as go
+import numpy as np
 import hmac
+import secrets
+import threading
+import time
+import queue
+import math
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
+from argon2 import PasswordHasher, extract_parameters
+from argon2.exceptions import InvalidHashError, VerificationError
 
 # Optional PDF dependency: pip install fpdf2
 try:
@@ -20,74 +30,236 @@ st.set_page_config(page_title="Footprint Buddy", layout="wide")
 
 # --- Helper Functions for User Management (SQLite) ---
 DB_PATH = "users.db"
-CURRENT_PBKDF2_ITERS = 310_000  # target iterations for PBKDF2
-
+CURRENT_PBKDF2_ITERS = 310_000  # default for legacy PBKDF2 records without "iter"
+# Argon2id for all new hashes (64 MiB, 3 passes, 2 lanes); stored as a self-describing PHC string
+PASSWORD_HASHER = PasswordHasher(time_cost=3, memory_cost=64 * 1024, parallelism=2)
+SCRYPT_R, SCRYPT_P = 8, 1  # block size / parallelism of the legacy scrypt records
+VERIFY_CACHE_SIZE = 1024  # remembered successful verifications
+DB_POOL_SIZE = 4  # pooled SQLite connections shared by all sessions
+DB_WRITE_RETRIES = 3  # extra attempts when the write lock can't be taken
+
+# journal_mode persists in the database file; the rest are per-connection and must be set on every open
+DB_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA busy_timeout=5000;
+PRAGMA cache_size=-20000;
+PRAGMA temp_store=MEMORY;
+"""
+
+def _open_db_conn():
+    # Autocommit mode: writes open their own transaction with BEGIN IMMEDIATE (see _db_write)
+    # Lock wait comes only from DB_PRAGMAS' busy_timeout (5 s); _db_write's retries are sized around it
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    conn.executescript(DB_PRAGMAS)
+    return conn
+
+@st.cache_resource
+def _db_pool():
+    # Opened once per process instead of on every helper call / rerun
+    pool = queue.Queue(maxsize=DB_POOL_SIZE)
+    for _ in range(DB_POOL_SIZE):
+        pool.put(_open_db_conn())
+    return pool
+
+@contextmanager
 def db_conn():
-    return sqlite3.connect(DB_PATH, timeout=30)
+    # Borrow a pooled connection; commit/rollback like sqlite3's own context manager, then return it
+    pool = _db_pool()
+    conn = pool.get()
+    try:
+        with conn:
+            yield conn
+    finally:
+        pool.put(conn)
+
+def _db_write(sql, params):
+    # BEGIN IMMEDIATE takes the write lock up front instead of upgrading a deferred read
+    # transaction mid-way; if the lock is still busy after busy_timeout (SQLITE_BUSY/LOCKED),
+    # back off and retry.
+    for attempt in range(DB_WRITE_RETRIES + 1):
+        try:
+            with db_conn() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute(sql, params)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    raise
+            return
+        except sqlite3.OperationalError as e:
+            # Only lock contention is worth retrying; anything else (missing table, I/O error) surfaces now.
+            # The low byte is the primary code, so extended ones like SQLITE_BUSY_SNAPSHOT count as busy.
+            if e.sqlite_errorcode & 0xFF not in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED) or attempt == DB_WRITE_RETRIES:
+                raise
+            time.sleep(0.05 * 2 ** attempt)
 
 # Legacy SHA256 (kept for backward compatibility)
 def legacy_sha256(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+    return hashlib.sha256(password.encode()).digest()
+
+# Legacy PBKDF2 (verify only). hashlib.pbkdf2_hmac runs OpenSSL's PKCS5_PBKDF2_HMAC
+# (hardware SHA-256 where available) on the OpenSSL-backed CPython builds we ship.
+def pbkdf2_sha256(password, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+
+# Legacy scrypt (verify only); the cost n is stored per user, r/p are the values the app always used
+def scrypt_hash(password, salt, n):
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=SCRYPT_R, p=SCRYPT_P, dklen=32)
+
+def hash_password(password):
+    # Typed users row (kdf, salt, hash, iters) for a new Argon2id hash
+    return ("argon2", None, PASSWORD_HASHER.hash(password), None)
+
+def argon2_verify(phc, password):
+    try:
+        return PASSWORD_HASHER.verify(phc, password)  # constant-time inside libargon2
+    except (VerificationError, InvalidHashError):
+        return False
 
-# New PBKDF2-based hashing with per-user salt
-def hash_password_pbkdf2(password, salt=None, iterations=CURRENT_PBKDF2_ITERS):
-    if salt is None:
-        salt = os.urandom(16)
-    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
-    return base64.b64encode(salt).decode("ascii"), base64.b64encode(dk).decode("ascii"), iterations
+@st.cache_resource
+def _verify_cache():
+    # Process-wide, shared by all sessions: a user logging in again (new tab, after logout,
+    # another device) skips the KDF. login() only runs on the Login button, never on plain reruns.
+    # The per-process secret keys the entries, so memory never holds a crackable unsalted digest.
+    return OrderedDict(), threading.Lock(), secrets.token_bytes(32)
+
+def _verify_cached(password, params, expected, check):
+    # Only successful checks are remembered, keyed by an HMAC of the input (never the plaintext).
+    # The key includes the KDF parameters and stored hash, so a password change naturally misses the cache.
+    cache, lock, process_secret = _verify_cache()
+    key = (params, expected, hmac.new(process_secret, password.encode("utf-8"), "sha256").digest())
+    with lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return True
+    ok = check()
+    if ok:
+        with lock:
+            cache[key] = True
+            if len(cache) > VERIFY_CACHE_SIZE:
+                cache.popitem(last=False)
+    return ok
 
-def verify_password(password, record):
+def _legacy_blob_to_row(blob):
     """
-    record can be:
-      - legacy string (sha256 hex)  -> verify against legacy
-      - dict {"salt": b64, "hash": b64, "iter": int} -> verify PBKDF2
+    Decode an old text password value once into a typed (kdf, salt, hash, iters) users row:
+      - Argon2 PHC string ("$argon2id$...") -> ("argon2", None, phc, None)
+      - legacy string (sha256 hex)  -> ("sha256", None, digest, None)
+      - JSON {"kdf": "scrypt", "salt": b64, "hash": b64, "n": int, "r": 8, "p": 1} -> ("scrypt", salt, dk, n)
+      - JSON {"salt": b64, "hash": b64, "iter": int} -> ("pbkdf2_sha256", salt, dk, iters)
+    Anything else becomes ("invalid", None, <original text>, None): kept, but never verifies.
     """
-    if isinstance(record, str):
-        # legacy
-        return hmac.compare_digest(record, legacy_sha256(password))
-    if isinstance(record, dict):
+    invalid = ("invalid", None, blob.encode("utf-8"), None)
+    if blob.startswith("$argon2"):
         try:
-            salt = base64.b64decode(record.get("salt", ""))
-            iters = int(record.get("iter", CURRENT_PBKDF2_ITERS))
-            expected = base64.b64decode(record.get("hash", ""))
-            dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iters)
-            return hmac.compare_digest(dk, expected)
-        except Exception:
-            return False
-    return False
+            extract_parameters(blob)
+        except InvalidHashError:
+            return invalid
+        return ("argon2", None, blob, None)
+    try:
+        record = json.loads(blob)
+    except Exception:
+        record = None
+    if not isinstance(record, dict):
+        # legacy SHA256 hex (an all-digit digest may also parse as a JSON number)
+        if len(blob) == 64 and all(c in "0123456789abcdef" for c in blob):
+            return ("sha256", None, bytes.fromhex(blob), None)
+        return invalid
+    try:
+        salt = base64.b64decode(record["salt"], validate=True)
+        expected = base64.b64decode(record["hash"], validate=True)
+        if record.get("kdf") == "scrypt":
+            kdf, cost = "scrypt", int(record["n"])
+            if (int(record["r"]), int(record["p"])) != (SCRYPT_R, SCRYPT_P) or cost < 2 or cost & (cost - 1):
+                return invalid
+        else:
+            kdf, cost = "pbkdf2_sha256", int(record.get("iter", CURRENT_PBKDF2_ITERS))
+    except (KeyError, TypeError, ValueError):
+        return invalid
+    if not salt or not expected or cost < 1:
+        return invalid
+    return (kdf, salt, expected, cost)
+
+def verify_password(password, row):
+    # row is the typed (kdf, salt, hash, iters) users row; comparisons stay constant-time
+    kdf, salt, expected, cost = row
+    if kdf == "argon2":
+        return _verify_cached(password, (kdf,), expected, lambda: argon2_verify(expected, password))
+    if kdf == "sha256":
+        return hmac.compare_digest(expected, legacy_sha256(password))
+    if kdf == "scrypt":
+        derive = scrypt_hash
+    elif kdf == "pbkdf2_sha256":
+        derive = pbkdf2_sha256
+    else:
+        return False  # unusable legacy record: no point running a KDF
+    try:
+        return _verify_cached(password, (kdf, salt, cost), expected,
+                              lambda: hmac.compare_digest(derive(password, salt, cost), expected))
+    except ValueError:  # e.g. scrypt cost beyond OpenSSL's memory limit
+        return False
 
+def needs_rehash(row):
+    # Legacy SHA256/PBKDF2/scrypt records, or Argon2 hashes below the current cost, are upgraded on login
+    kdf, _, expected, _ = row
+    return kdf != "argon2" or PASSWORD_HASHER.check_needs_rehash(expected)
+
+# Keyed by username with no rowid: an auth lookup is a single B-tree probe.
+# kdf: argon2 | scrypt | pbkdf2_sha256 | sha256 | invalid
+# hash: argon2 PHC string, or the raw derived key / digest; iters: PBKDF2 iterations or scrypt n
+USERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    kdf TEXT NOT NULL,
+    salt BLOB,
+    hash BLOB NOT NULL,
+    iters INTEGER
+) WITHOUT ROWID
+"""
+
+@st.cache_resource
 def init_db():
-    # Make the app self-initializing
-    with db_conn() as conn:
-        conn.execute("PRAGMA journal_mode=WAL;")  # better concurrency for Streamlit
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL
-        )
-        """)
-        conn.commit()
-
-def get_user_password_blob(username):
+    # Make the app self-initializing (once per process, not on every rerun)
+    with db_conn() as conn:  # db_conn() enables WAL for better concurrency under Streamlit
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cols = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+            if "password" in cols:
+                # One-time migration from the text password column (JSON / hex / PHC) to typed columns
+                conn.execute("ALTER TABLE users RENAME TO users_text")
+                conn.execute(USERS_SCHEMA)
+                conn.executemany(
+                    "INSERT INTO users (username, kdf, salt, hash, iters) VALUES (?, ?, ?, ?, ?)",
+                    ((username, *_legacy_blob_to_row(blob))
+                     for username, blob in conn.execute("SELECT username, password FROM users_text").fetchall()),
+                )
+                conn.execute("DROP TABLE users_text")
+            else:
+                conn.execute(USERS_SCHEMA)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+# Bounded: the key is whatever username a visitor types, including misses cached as None
+@st.cache_data(ttl=300, max_entries=1024, show_spinner=False)
+def get_user_record(username):
     with db_conn() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT password FROM users WHERE username = ?", (username,))
-        row = cur.fetchone()
-        return row[0] if row else None
+        cur.execute("SELECT kdf, salt, hash, iters FROM users WHERE username = ?", (username,))
+        return cur.fetchone()
 
-def set_user_password_blob(username, blob):
-    with db_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("UPDATE users SET password = ? WHERE username = ?", (blob, username))
-        conn.commit()
+def set_user_record(username, row):
+    _db_write("UPDATE users SET kdf = ?, salt = ?, hash = ?, iters = ? WHERE username = ?", (*row, username))
+    get_user_record.clear()
 
-def create_user_row(username, password_blob):
+def create_user_row(username, row):
     try:
-        with db_conn() as conn:
-            cur = conn.cursor()
-            cur.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password_blob))
-            conn.commit()
+        _db_write("INSERT INTO users (username, kdf, salt, hash, iters) VALUES (?, ?, ?, ?, ?)", (username, *row))
+        get_user_record.clear()  # drop any cached "no such user"
         return True
     except sqlite3.IntegrityError:
         # Username already exists
@@ -97,32 +269,20 @@ def signup(username, password):
     # Basic guard (UI already validates)
     if not username or not password:
         return False
-    if get_user_password_blob(username) is not None:
+    if get_user_record(username) is not None:
         return False
-    salt_b64, hash_b64, iters = hash_password_pbkdf2(password)
-    record = {"salt": salt_b64, "hash": hash_b64, "iter": iters}
-    return create_user_row(username, json.dumps(record))
+    return create_user_row(username, hash_password(password))
 
 def login(username, password):
-    blob = get_user_password_blob(username)
-    if blob is None:
+    row = get_user_record(username)
+    if row is None:
         return False
 
-    # Parse stored password; can be JSON (PBKDF2) or legacy SHA256 hex string
-    try:
-        record = json.loads(blob)
-    except Exception:
-        record = blob  # legacy string
-
-    ok = verify_password(password, record)
+    ok = verify_password(password, row)
 
-    # Auto-upgrade legacy SHA256 to PBKDF2 or bump low-iteration PBKDF2 on successful login
-    if ok:
-        needs_rehash = isinstance(record, str) or (isinstance(record, dict) and int(record.get("iter", 0)) < CURRENT_PBKDF2_ITERS)
-        if needs_rehash:
-            salt_b64, hash_b64, iters = hash_password_pbkdf2(password)
-            new_record = {"salt": salt_b64, "hash": hash_b64, "iter": iters}
-            set_user_password_blob(username, json.dumps(new_record))
+    # Auto-upgrade legacy SHA256/PBKDF2/scrypt records to Argon2id on successful login
+    if ok and needs_rehash(row):
+        set_user_record(username, hash_password(password))
 
     return ok
 
@@ -134,10 +294,10 @@ def migrate_json_users_to_sqlite(json_path="users.json"):
         with open(json_path, "r") as f:
             users = json.load(f)
         for username, record in users.items():
-            if get_user_password_blob(username) is not None:
+            if get_user_record(username) is not None:
                 continue
             blob = json.dumps(record) if isinstance(record, dict) else record
-            create_user_row(username, blob)
+            create_user_row(username, _legacy_blob_to_row(blob))
         os.rename(json_path, json_path + ".migrated.bak")
         print("✅ Migration complete. Backup created:", json_path + ".migrated.bak")
     except Exception as e:
@@ -161,13 +321,16 @@ if "dummy_rerun_flag" not in st.session_state:
 def rerun():
     st.session_state.dummy_rerun_flag = not st.session_state.dummy_rerun_flag
 
+# Login/signup widget keys wiped on logout
+AUTH_FORM_KEYS = ("login_username", "login_password", "signup_username", "signup_password", "confirm_password")
+
 def logout():
     st.session_state.logged_in = False
     st.session_state.current_user = ""
     st.session_state.show_results = False
-    for key in ["login_username", "login_password", "signup_username", "signup_password", "confirm_password"]:
-        if key in st.session_state:
-            del st.session_state[key]
+    st.session_state.pop("_pdf_cache", None)
+    for key in AUTH_FORM_KEYS:
+        st.session_state.pop(key, None)
     rerun()
 
 # --- Emission Factors ---
@@ -214,8 +377,136 @@ ELECTRICITY_BY_SOURCE = {
     "Mixed": 0.50
 }
 
+# Flattened lookups, built once at import; selectboxes return an index into these tuples
+COMMUTE_MODES = tuple(EMISSION_FACTORS["India"]["Transportation"])
+COMMUTE_FACTORS = tuple(EMISSION_FACTORS["India"]["Transportation"].values())
+COMMUTE_IS_CAR = tuple(m.startswith("Car") or m == "Electric Car" for m in COMMUTE_MODES)  # carpool only divides cars
+DIET_TYPES = tuple(EMISSION_FACTORS["India"]["Diet"])
+DIET_FACTORS = tuple(EMISSION_FACTORS["India"]["Diet"].values())
+COOKING_FUELS = tuple(EMISSION_FACTORS["India"]["CookingFuel"])
+COOKING_FUEL_FACTORS = tuple(EMISSION_FACTORS["India"]["CookingFuel"].values())
+# Amount input per cooking fuel (label, max_value, step), aligned with COOKING_FUELS
+_COOKING_FUEL_INPUT_SPECS = {
+    "LPG": ("Amount of LPG used (kg/month)", 100.0, 0.1),
+    "Natural Gas": ("Amount of Natural Gas used (m³/month)", 100.0, 0.1),
+    "Electricity": ("Amount of Electricity used for cooking (kWh/month)", 1000.0, 1.0),
+    "Biomass": ("Amount of Biomass used (kg/month)", 100.0, 0.1),
+}
+COOKING_FUEL_INPUTS = tuple(_COOKING_FUEL_INPUT_SPECS[f] for f in COOKING_FUELS)
+SHORT_HAUL_FACTOR = EMISSION_FACTORS["India"]["Flight"]["Short-haul"]
+LONG_HAUL_FACTOR = EMISSION_FACTORS["India"]["Flight"]["Long-haul"]
+GRID_ELECTRICITY_FACTOR = EMISSION_FACTORS["India"]["Electricity"]
+WATER_FACTOR = EMISSION_FACTORS["India"]["Water"]
+WASTE_FACTOR = EMISSION_FACTORS["India"]["Waste"]
+STREAMING_FACTOR = EMISSION_FACTORS["India"]["Streaming"]
+FLIGHT_CLASS_MULTIPLIERS = {"Economy": 1, "Business": 1.5, "First": 2.5}
+# Remaining selectbox options
+FLIGHT_CLASSES = tuple(FLIGHT_CLASS_MULTIPLIERS)
+ELECTRICITY_SOURCES = tuple(ELECTRICITY_BY_SOURCE)
+WATER_SOURCES = ("Municipal", "Borewell", "Rainwater", "Other")
+STREAMING_DEVICES = ("Phone", "Laptop", "TV", "Tablet", "Other")
+
+# Result categories, in the order compute_emissions() returns them
+EMISSION_CATEGORIES = ("Commute", "Flight", "Electricity", "Cooking Fuel", "Diet", "Water", "Waste", "Streaming")
+
+# --- Emissions kernel ---
+# Pure numeric (no dicts/strings): the UI resolves factor lookups and choices before calling it.
+# Returns tonnes CO2/year per category, in EMISSION_CATEGORIES order.
+# Each category is factor * annual quantity * modifier / divisor kg. The operand order reproduces
+# the per-category formulas exactly (flights, diet and streaming fold their factor into the
+# quantity for that reason), so the float results and the rounding below match them bit for bit.
+def compute_emissions(commute_factor, commute_km_day, commute_days_week, commute_share,
+                      flight_mult, short_flights, long_flights, short_haul_factor, long_haul_factor,
+                      elec_factor, electricity_kwh_month, household_size,
+                      cooking_factor, cooking_amount_month, cooking_is_electric, stove_modifier, cooking_people,
+                      diet_factor, meals_per_day, meals_out_week,
+                      water_factor, water_l_day, water_modifier,
+                      waste_factor, waste_kg_week, recycling_pct,
+                      streaming_factor, streaming_hours_week):
+    # 1. Commute: commute_share is the carpool size for cars, 1 otherwise
+    commute_km = commute_km_day * commute_days_week * 52 / max(1, commute_share)
+    # 2. Flights: class multiplier applies to each leg
+    flight_kg = (short_flights * 1100 * short_haul_factor * flight_mult
+                 + long_flights * 6000 * long_haul_factor * flight_mult)
+    # 3. Electricity: subtract cooking kWh when cooking is electric to avoid double count
+    cooking_amount_year = cooking_amount_month * 12
+    electricity_year_kwh = electricity_kwh_month * 12
+    if cooking_is_electric:
+        electricity_year_kwh = max(0.0, electricity_year_kwh - cooking_amount_year)
+    # 5. Diet: eating-out meals (capped) carry a 30% uplift
+    meals_year = meals_per_day * 365
+    meals_out_year = min(meals_out_week * 52, meals_year)
+    diet_kg = diet_factor * (meals_year - meals_out_year) + (diet_factor * 1.3) * meals_out_year
+
+    factors = np.array([
+        commute_factor, 1.0, elec_factor, cooking_factor,
+        1.0, water_factor, waste_factor, 1.0,
+    ])
+    quantities = np.array([
+        commute_km, flight_kg, electricity_year_kwh, cooking_amount_year,
+        diet_kg, water_l_day * 365, waste_kg_week * 52, streaming_factor * streaming_hours_week * 52,
+    ])
+    modifiers = np.array([
+        1.0, 1.0, 1.0, stove_modifier,
+        1.0, water_modifier, 1 - recycling_pct / 100, 1.0,
+    ])
+    divisors = np.array([
+        1.0, 1.0,
+        max(1, household_size),  # apportion by household size
+        max(1, cooking_people),  # per person sharing the kitchen
+        1.0, 1.0, 1.0, 1.0,
+    ])
+    # Python's round() on each element: np.round scales by 100 and rounds half-to-even,
+    # which shifts values such as 0.165 down to 0.16
+    return tuple(round(x, 2) for x in (factors * quantities * modifiers / divisors / 1000).tolist())
+
+CHART_COLORS = ('#1b5e20', '#1976d2', '#388e3c', '#ff7043', '#fbc02d', '#0288d1', '#8d6e63', '#7e57c2')
+
+# Figures depend only on the per-category values, so reruns of the results page reuse them.
+# cache_resource hands back the shared figure (cache_data would unpickle and re-validate a copy
+# on every hit, which costs more than building it); callers only render it, never mutate it.
+@st.cache_resource(max_entries=128, show_spinner=False)
+def build_pie(values):
+    fig = go.Figure(data=[go.Pie(
+        labels=EMISSION_CATEGORIES,
+        values=values,
+        marker=dict(colors=CHART_COLORS),
+        textinfo='label+percent+value',
+        textfont=dict(size=18, color='black'),
+        textposition='inside',
+        insidetextorientation='radial',
+        pull=[0.05]*8
+    )])
+    fig.update_layout(
+        margin=dict(t=20, b=20, l=20, r=20),
+        showlegend=True,
+        height=650
+    )
+    return fig
+
+@st.cache_resource(max_entries=128, show_spinner=False)
+def build_bar(values):
+    bar_fig = go.Figure(data=[
+        go.Bar(
+            x=EMISSION_CATEGORIES,
+            y=values,
+            marker_color=CHART_COLORS,
+            text=[f"{v} t" for v in values],
+            textposition='auto'
+        )
+    ])
+    bar_fig.update_layout(
+        title="",
+        xaxis_title="Factor",
+        yaxis_title="Tonnes CO₂/year",
+        plot_bgcolor="#f7fafc",
+        paper_bgcolor="#f7fafc",
+        font=dict(family="Roboto, sans-serif", size=16)
+    )
+    return bar_fig
+
 # --- Custom CSS ---
-st.markdown("""
+CSS_BLOCK = """
     <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@700&family=Roboto:wght@400;700&display=swap" rel="stylesheet">
     <style>
         .centered-card {
@@ -284,20 +575,19 @@ st.markdown("""
         }
     </style>
     <div class="main-bg"></div>
-""", unsafe_allow_html=True)
+"""
 
-# --- LOGIN / SIGNUP PAGE ---
-if not st.session_state.logged_in:
-    st.markdown("""
+# Login page background and welcome card
+LOGIN_BG_CSS = """
         <style>
             .stApp {
                 background: url("https://vapor-eu-north-1-prod-1614245610.s3.eu-north-1.amazonaws.com/editor-uploads/XXI6eRoAVTgaPMnF8IVlgeuKDEBecthMt4tvyNzR.png") no-repeat center center fixed;
                 background-size: cover;
             }
         </style>
-    """, unsafe_allow_html=True)
+    """
 
-    st.markdown("""
+LOGIN_CARD_HTML = """
     <div class="centered-card">
         <div class="main-header">Footprint Buddy</div>
         <div class="sub-header">Welcome!</div>
@@ -305,7 +595,52 @@ if not st.session_state.logged_in:
             Start your journey to a greener future. Track, understand, and reduce your carbon footprint today!
         </div>
     </div>
-    """, unsafe_allow_html=True)
+    """
+
+# One results card; filled with .format per category
+_RESULTS_CARD_TMPL = """
+                    <div style='background:#f7fafc; padding:20px; border-radius:12px; margin-bottom:15px; font-family: "Roboto", sans-serif;'>
+                        <h3 style="font-family: 'Montserrat', sans-serif; color:#1b5e20;">{title}</h3>
+                        <p style="font-size:22px;">{value} tonnes CO₂/year</p>
+                        <small>{sub}</small>
+                    </div>
+                """
+
+# Main-page greeting; filled with the logged-in username
+_WELCOME_TMPL = """
+        <div style="display:flex; flex-direction:column; align-items:center; justify-content:center; margin-top:30px; margin-bottom:30px;">
+            <div style="font-family:'Montserrat',sans-serif; font-size:54px; color:#1b5e20; font-weight:700; text-align:center;">
+                Footprint Buddy
+            </div>
+            <div style="font-family:'Montserrat',sans-serif; font-size:32px; color:#388e3c; font-weight:700; margin-top:10px; text-align:center;">
+                Welcome, {user}!
+            </div>
+            <div style="font-family:'Roboto',sans-serif; font-size:26px; color:#2e7d32; margin-top:10px; text-align:center;">
+                Calculate your annual carbon footprint and take your first step towards a greener tomorrow.
+            </div>
+        </div>
+    """
+
+RESULTS_HEADER_HTML = """
+        <div style="text-align:center;">
+            <div class="main-header">Your Footprint Buddy Results 🌍</div>
+        </div>
+    """
+
+_TOTAL_CARD_TMPL = """
+        <div style='background:#ffebee; padding:20px; border-radius:12px; margin-top:20px; font-family: "Roboto", sans-serif; text-align:center;'>
+            <h3 style='color:#d32f2f; font-family: "Montserrat", sans-serif;'>🌍 Total Footprint</h3>
+            <p style='font-size:28px; font-weight:bold; color:#d32f2f;'>{total} tonnes CO₂/year</p>
+        </div>
+    """
+
+st.markdown(CSS_BLOCK, unsafe_allow_html=True)
+
+# --- LOGIN / SIGNUP PAGE ---
+if not st.session_state.logged_in:
+    st.markdown(LOGIN_BG_CSS, unsafe_allow_html=True)
+
+    st.markdown(LOGIN_CARD_HTML, unsafe_allow_html=True)
 
     tab1, tab2 = st.tabs(["🔑 Login", "🆕 Sign Up"])
 
@@ -350,25 +685,14 @@ elif not st.session_state.show_results:
         if st.button("Logout", key="logout_btn", help="Logout"):
             logout()
 
-    st.markdown(f"""
-        <div style="display:flex; flex-direction:column; align-items:center; justify-content:center; margin-top:30px; margin-bottom:30px;">
-            <div style="font-family:'Montserrat',sans-serif; font-size:54px; color:#1b5e20; font-weight:700; text-align:center;">
-                Footprint Buddy
-            </div>
-            <div style="font-family:'Montserrat',sans-serif; font-size:32px; color:#388e3c; font-weight:700; margin-top:10px; text-align:center;">
-                Welcome, {st.session_state.current_user}!
-            </div>
-            <div style="font-family:'Roboto',sans-serif; font-size:26px; color:#2e7d32; margin-top:10px; text-align:center;">
-                Calculate your annual carbon footprint and take your first step towards a greener tomorrow.
-            </div>
-        </div>
-    """, unsafe_allow_html=True)
+    st.markdown(_WELCOME_TMPL.format(user=st.session_state.current_user), unsafe_allow_html=True)
 
     st.markdown('<br>', unsafe_allow_html=True)
 
     # 1. Commute
     st.markdown('<div class="sub-header">🚗 Daily commute distance (in km)</div>', unsafe_allow_html=True)
-    commute_mode = st.selectbox("Mode of transport", list(EMISSION_FACTORS["India"]["Transportation"].keys()), key="commute_mode")
+    commute_idx = st.selectbox("Mode of transport", range(len(COMMUTE_MODES)), format_func=COMMUTE_MODES.__getitem__, key="commute_mode")
+    commute_mode = COMMUTE_MODES[commute_idx]
     commute_distance = st.number_input("Distance (km/day)", min_value=0.0, max_value=100.0, value=0.0, step=0.1, key="distance_input")
     commute_days_per_week = st.number_input("Commute days per week", min_value=0, max_value=7, value=5, step=1, key="commute_days_per_week")
     carpooling = st.number_input("Number of people sharing (if car; buses/trains already per passenger)", min_value=1, max_value=10, value=1, step=1, key="carpooling_input")
@@ -377,43 +701,40 @@ elif not st.session_state.show_results:
     st.markdown('<div class="sub-header">✈️ Flight Travel</div>', unsafe_allow_html=True)
     short_flights = st.number_input("Number of short-haul flights per year", min_value=0, max_value=50, value=0, step=1, key="short_flights")
     long_flights = st.number_input("Number of long-haul flights per year", min_value=0, max_value=20, value=0, step=1, key="long_flights")
-    flight_class = st.selectbox("Class of travel", ["Economy", "Business", "First"], key="flight_class")
+    flight_class = st.selectbox("Class of travel", FLIGHT_CLASSES, key="flight_class")
 
     # 3. Electricity
     st.markdown('<div class="sub-header">💡 Monthly electricity consumption (in kWh)</div>', unsafe_allow_html=True)
     electricity = st.number_input("Electricity (kWh/month)", min_value=0.0, max_value=1000.0, value=0.0, step=1.0, key="electricity_input")
-    elec_source = st.selectbox("Source of electricity", ["Grid", "Solar", "Wind", "Mixed"], key="elec_source")
+    elec_source = st.selectbox("Source of electricity", ELECTRICITY_SOURCES, key="elec_source")
     household_size = st.number_input("Number of people in household", min_value=1, max_value=20, value=1, step=1, key="household_size")
 
     # 4. Cooking Fuel
     st.markdown('<div class="sub-header">🍳 Cooking fuel type</div>', unsafe_allow_html=True)
-    cooking_fuel_type = st.selectbox(
+    cooking_fuel_idx = st.selectbox(
         "Select cooking fuel type",
-        list(EMISSION_FACTORS["India"]["CookingFuel"].keys()),
+        range(len(COOKING_FUELS)),
+        format_func=COOKING_FUELS.__getitem__,
         key="cooking_fuel_type"
     )
-    if cooking_fuel_type == "LPG" or cooking_fuel_type == "Biomass":
-        cooking_fuel_amount = st.number_input(f"Amount of {cooking_fuel_type} used (kg/month)", min_value=0.0, max_value=100.0, value=0.0, step=0.1, key="cooking_fuel_amount")
-    elif cooking_fuel_type == "Natural Gas":
-        cooking_fuel_amount = st.number_input("Amount of Natural Gas used (m³/month)", min_value=0.0, max_value=100.0, value=0.0, step=0.1, key="cooking_fuel_amount")
-    elif cooking_fuel_type == "Electricity":
-        cooking_fuel_amount = st.number_input("Amount of Electricity used for cooking (kWh/month)", min_value=0.0, max_value=1000.0, value=0.0, step=1.0, key="cooking_fuel_amount")
-    else:
-        cooking_fuel_amount = 0.0
+    cooking_fuel_type = COOKING_FUELS[cooking_fuel_idx]
+    fuel_label, fuel_max, fuel_step = COOKING_FUEL_INPUTS[cooking_fuel_idx]
+    cooking_fuel_amount = st.number_input(fuel_label, min_value=0.0, max_value=fuel_max, value=0.0, step=fuel_step, key="cooking_fuel_amount")
     cooking_people = st.number_input("Number of people sharing kitchen", min_value=1, max_value=20, value=1, step=1, key="cooking_people")
     efficient_stove = st.radio("Use of energy-efficient stove?", ["Yes", "No"], key="efficient_stove")
 
     # 5. Diet
     st.markdown('<div class="sub-header">🍽️ Number of meals per day</div>', unsafe_allow_html=True)
     meals = st.number_input("Meals per day", min_value=0, max_value=10, value=3, step=1, key="meals_input")
-    diet_type = st.selectbox("Diet type", list(EMISSION_FACTORS["India"]["Diet"].keys()), key="diet_type")
+    diet_idx = st.selectbox("Diet type", range(len(DIET_TYPES)), format_func=DIET_TYPES.__getitem__, key="diet_type")
+    diet_type = DIET_TYPES[diet_idx]
     eating_out = st.slider("Meals eaten out per week", min_value=0, max_value=21, value=0, step=1, key="eating_out_input")
 
     # 6. Water
     st.markdown('<div class="sub-header">🚰 Daily water usage (in liters)</div>', unsafe_allow_html=True)
     water = st.number_input("Water Usage (liters/day)", min_value=0.0, max_value=1000.0, value=0.0, step=1.0, key="water_input")
     water_saving = st.radio("Use of water-saving devices?", ["Yes", "No"], key="water_saving")
-    water_source = st.selectbox("Source of water", ["Municipal", "Borewell", "Rainwater", "Other"], key="water_source")
+    water_source = st.selectbox("Source of water", WATER_SOURCES, key="water_source")
 
     # 7. Waste
     st.markdown('<div class="sub-header">🗑️ Waste generated per week (in kg)</div>', unsafe_allow_html=True)
@@ -424,122 +745,64 @@ elif not st.session_state.show_results:
     # 8. Streaming
     st.markdown('<div class="sub-header">📺 Average hours of video streaming per week</div>', unsafe_allow_html=True)
     streaming_hours = st.number_input("Streaming hours/week", min_value=0.0, max_value=168.0, value=0.0, step=0.1, key="streaming_hours")
-    streaming_device = st.selectbox("Device used for streaming", ["Phone", "Laptop", "TV", "Tablet", "Other"], key="streaming_device")
+    streaming_device = st.selectbox("Device used for streaming", STREAMING_DEVICES, key="streaming_device")
 
-    # --- Emissions Calculation (with fixes) ---
-
-    # 1. Commute (annualized). Use days/week; carpool reduction only for cars, including Electric Car.
-    annual_commute_km = commute_distance * commute_days_per_week * 52
-    base_commute_factor = EMISSION_FACTORS["India"]["Transportation"][commute_mode]
-    is_car = commute_mode.startswith("Car") or (commute_mode == "Electric Car")
-    if is_car and carpooling > 0:
-        commute_emissions_kg = base_commute_factor * (annual_commute_km / max(1, carpooling))
-    else:
-        # bus/train/bike/walk/electric car: no carpool division (already per passenger-km or individual)
-        commute_emissions_kg = base_commute_factor * annual_commute_km
-    commute_emissions = round(commute_emissions_kg / 1000, 2)  # tonnes/year
-
-    # 2. Flight Travel
-    flight_class_multiplier = {"Economy": 1, "Business": 1.5, "First": 2.5}[flight_class]
-    short_flight_emissions = short_flights * 1100 * EMISSION_FACTORS["India"]["Flight"]["Short-haul"] * flight_class_multiplier
-    long_flight_emissions = long_flights * 6000 * EMISSION_FACTORS["India"]["Flight"]["Long-haul"] * flight_class_multiplier
-    flight_emissions = round((short_flight_emissions + long_flight_emissions) / 1000, 2)  # tonnes/year
-
-    # 3. Electricity (annualized, per household -> apportion per person; adjust by source; subtract cooking kWh if cooking is Electricity)
-    electricity_year_kwh = electricity * 12
-
-    if cooking_fuel_type == "Electricity":
-        # Subtract cooking-electricity from household electricity to avoid double count
-        cooking_kwh_year = cooking_fuel_amount * 12
-        electricity_year_kwh = max(0.0, electricity_year_kwh - cooking_kwh_year)
-
-    elec_factor = ELECTRICITY_BY_SOURCE.get(elec_source, EMISSION_FACTORS["India"]["Electricity"])
-    electricity_emissions_kg = elec_factor * electricity_year_kwh
-    # Apportion by household size
-    electricity_emissions = round((electricity_emissions_kg / max(1, household_size)) / 1000, 2)
-
-    # 4. Cooking Fuel (annualized; per-person via cooking_people; efficient stove reduction)
-    cooking_fuel_amount_year = cooking_fuel_amount * 12
-    cooking_factor = EMISSION_FACTORS["India"]["CookingFuel"][cooking_fuel_type]
-    # Use electricity source factor if cooking uses electricity
-    if cooking_fuel_type == "Electricity":
-        cooking_factor = ELECTRICITY_BY_SOURCE.get(elec_source, EMISSION_FACTORS["India"]["Electricity"])
-    cooking_fuel_emissions_kg = cooking_factor * cooking_fuel_amount_year
-
-    # Efficient stove reduction (e.g., 20%)
-    if efficient_stove == "Yes":
-        cooking_fuel_emissions_kg *= 0.8
-
-    # Per-person
-    cooking_fuel_emissions = round((cooking_fuel_emissions_kg / max(1, cooking_people)) / 1000, 2)
-
-    # 5. Diet (annualized per meal; eating out uplift for those meals)
-    meals_year = meals * 365
-    diet_base = EMISSION_FACTORS["India"]["Diet"][diet_type]
-    meals_out_year = eating_out * 52
-    meals_out_year = min(meals_out_year, meals_year)  # cap
-
-    # 30% uplift for eating-out meals
-    diet_emissions_kg = diet_base * (meals_year - meals_out_year) + (diet_base * 1.3) * meals_out_year
-    diet_emissions = round(diet_emissions_kg / 1000, 2)
-
-    # 6. Water (annualized; water-saving reduction 10%)
-    water_year = water * 365
-    water_factor = EMISSION_FACTORS["India"]["Water"]
-    water_emissions_kg = water_factor * water_year
-    if water_saving == "Yes":
-        water_emissions_kg *= 0.9
-    water_emissions = round(water_emissions_kg / 1000, 2)
-
-    # 7. Waste (annualized, adjust for recycling)
-    waste_year = waste * 52
-    waste_emissions = EMISSION_FACTORS["India"]["Waste"] * waste_year * (1 - recycling/100)
-    waste_emissions = round(waste_emissions / 1000, 2)
-
-    # 8. Streaming (network + datacenter only; device energy already included in electricity)
-    streaming_emissions_kg = EMISSION_FACTORS["India"]["Streaming"] * streaming_hours * 52
-    streaming_emissions = round(streaming_emissions_kg / 1000, 2)
-
-    total_emissions = round(
-        commute_emissions + flight_emissions + electricity_emissions +
-        cooking_fuel_emissions + diet_emissions + water_emissions +
-        waste_emissions + streaming_emissions, 2
-    )
+    # Only compute when the button is pressed; widget edits just rerun the form
+    if st.button("Calculate CO2 Emissions"):
+        # --- Emissions Calculation (with fixes) ---
+        # Resolve choices and factor lookups here; the arithmetic lives in compute_emissions().
+        flight_class_multiplier = FLIGHT_CLASS_MULTIPLIERS[flight_class]
+        elec_factor = ELECTRICITY_BY_SOURCE.get(elec_source, GRID_ELECTRICITY_FACTOR)
+        cooking_is_electric = cooking_fuel_type == "Electricity"
+        # Use electricity source factor if cooking uses electricity
+        cooking_factor = elec_factor if cooking_is_electric else COOKING_FUEL_FACTORS[cooking_fuel_idx]
+
+        tonnes = compute_emissions(
+            COMMUTE_FACTORS[commute_idx], commute_distance, commute_days_per_week,
+            carpooling if COMMUTE_IS_CAR[commute_idx] else 1,
+            flight_class_multiplier, short_flights, long_flights,
+            SHORT_HAUL_FACTOR, LONG_HAUL_FACTOR,
+            elec_factor, electricity, household_size,
+            cooking_factor, cooking_fuel_amount, cooking_is_electric,
+            0.8 if efficient_stove == "Yes" else 1.0,  # efficient stove: 20% reduction
+            cooking_people,
+            DIET_FACTORS[diet_idx], meals, eating_out,
+            WATER_FACTOR, water, 0.9 if water_saving == "Yes" else 1.0,  # water-saving: 10%
+            WASTE_FACTOR, waste, recycling,
+            STREAMING_FACTOR, streaming_hours,
+        )
 
-    st.session_state.results = {
-        "Commute": commute_emissions,
-        "Flight": flight_emissions,
-        "Electricity": electricity_emissions,
-        "Cooking Fuel": cooking_fuel_emissions,
-        "Diet": diet_emissions,
-        "Water": water_emissions,
-        "Waste": waste_emissions,
-        "Streaming": streaming_emissions,
-        "Total": total_emissions,
-        # Details for display/future use
-        "Details": {
-            "Commute Mode": commute_mode,
-            "Commute Days/Week": commute_days_per_week,
-            "Carpooling": carpooling,
-            "Short Flights": short_flights,
-            "Long Flights": long_flights,
-            "Flight Class": flight_class,
-            "Electricity Source": elec_source,
-            "Household Size": household_size,
-            "Cooking Fuel Type": cooking_fuel_type,
-            "Cooking People": cooking_people,
-            "Efficient Stove": efficient_stove,
-            "Diet Type": diet_type,
-            "Eating Out": eating_out,
-            "Water Saving": water_saving,
-            "Water Source": water_source,
-            "Recycling %": recycling,
-            "Waste Types": waste_type,
-            "Streaming Device": streaming_device
+        total_emissions = round(math.fsum(tonnes), 2)
+
+        # Per-category values in EMISSION_CATEGORIES order, shared by the charts and the PDF
+        st.session_state.results_ordered = tonnes
+
+        st.session_state.results = {
+            **dict(zip(EMISSION_CATEGORIES, tonnes)),
+            "Total": total_emissions,
+            # Details for display/future use
+            "Details": {
+                "Commute Mode": commute_mode,
+                "Commute Days/Week": commute_days_per_week,
+                "Carpooling": carpooling,
+                "Short Flights": short_flights,
+                "Long Flights": long_flights,
+                "Flight Class": flight_class,
+                "Electricity Source": elec_source,
+                "Household Size": household_size,
+                "Cooking Fuel Type": cooking_fuel_type,
+                "Cooking People": cooking_people,
+                "Efficient Stove": efficient_stove,
+                "Diet Type": diet_type,
+                "Eating Out": eating_out,
+                "Water Saving": water_saving,
+                "Water Source": water_source,
+                "Recycling %": recycling,
+                "Waste Types": waste_type,
+                "Streaming Device": streaming_device
+            }
         }
-    }
 
-    if st.button("Calculate CO2 Emissions"):
         st.session_state.show_results = True
         rerun()
 
@@ -552,11 +815,7 @@ else:
         if st.button("Logout", key="logout_btn2", help="Logout"):
             logout()
 
-    st.markdown("""
-        <div style="text-align:center;">
-            <div class="main-header">Your Footprint Buddy Results 🌍</div>
-        </div>
-    """, unsafe_allow_html=True)
+    st.markdown(RESULTS_HEADER_HTML, unsafe_allow_html=True)
 
     results = st.session_state.results
     details = results.get("Details", {})
@@ -573,18 +832,12 @@ else:
         ("Streaming", "📺 Streaming", f"Device: {details.get('Streaming Device','')}")
     ]
 
-    for i in range(0, len(factors), 2):
-        c1, c2 = st.columns(2)
-        for j, c in enumerate([c1, c2]):
-            if i + j < len(factors):
-                key, title, sub = factors[i + j]
-                c.markdown(f"""
-                    <div style='background:#f7fafc; padding:20px; border-radius:12px; margin-bottom:15px; font-family: "Roboto", sans-serif;'>
-                        <h3 style="font-family: 'Montserrat', sans-serif; color:#1b5e20;">{title}</h3>
-                        <p style="font-size:22px;">{results[key]} tonnes CO₂/year</p>
-                        <small>{sub}</small>
-                    </div>
-                """, unsafe_allow_html=True)
+    # Build every card up front, then lay them out two per row
+    card_fmt = _RESULTS_CARD_TMPL.format
+    cards = [card_fmt(title=title, value=results[key], sub=sub) for key, title, sub in factors]
+    for i in range(0, len(cards), 2):
+        for c, card in zip(st.columns(2), cards[i:i + 2]):
+            c.markdown(card, unsafe_allow_html=True)
 
     total = results['Total']
 
@@ -592,58 +845,18 @@ else:
     if total > 0:
         # Pie chart
         st.markdown("<h2 style='text-align:center; color:#1976d2; margin-top:40px;'>Pie Chart</h2>", unsafe_allow_html=True)
-        pie_labels = ["Commute", "Flight", "Electricity", "Cooking Fuel", "Diet", "Water", "Waste", "Streaming"]
-        pie_values = [results[k] for k in pie_labels]
-        pie_colors = ['#1b5e20', '#1976d2', '#388e3c', '#ff7043', '#fbc02d', '#0288d1', '#8d6e63', '#7e57c2']
-
-        fig = go.Figure(data=[go.Pie(
-            labels=pie_labels,
-            values=pie_values,
-            marker=dict(colors=pie_colors),
-            textinfo='label+percent+value',
-            textfont=dict(size=18, color='black'),
-            textposition='inside',
-            insidetextorientation='radial',
-            pull=[0.05]*8
-        )])
-        fig.update_layout(
-            margin=dict(t=20, b=20, l=20, r=20),
-            showlegend=True,
-            height=650
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        chart_values = st.session_state.results_ordered
+        st.plotly_chart(build_pie(chart_values), use_container_width=True)
 
         st.markdown("<br><br>", unsafe_allow_html=True)
 
         # Bar chart
         st.markdown("<h2 style='text-align:center; color:#388e3c; margin-bottom:20px;'>Bar Graph</h2>", unsafe_allow_html=True)
-        bar_fig = go.Figure(data=[
-            go.Bar(
-                x=pie_labels,
-                y=pie_values,
-                marker_color=pie_colors,
-                text=[f"{v} t" for v in pie_values],
-                textposition='auto'
-            )
-        ])
-        bar_fig.update_layout(
-            title="",
-            xaxis_title="Factor",
-            yaxis_title="Tonnes CO₂/year",
-            plot_bgcolor="#f7fafc",
-            paper_bgcolor="#f7fafc",
-            font=dict(family="Roboto, sans-serif", size=16)
-        )
-        st.plotly_chart(bar_fig, use_container_width=True)
+        st.plotly_chart(build_bar(chart_values), use_container_width=True)
     else:
         st.info("No emissions data to visualize yet — enter some values and calculate to see charts.")
 
-    st.markdown(f"""
-        <div style='background:#ffebee; padding:20px; border-radius:12px; margin-top:20px; font-family: "Roboto", sans-serif; text-align:center;'>
-            <h3 style='color:#d32f2f; font-family: "Montserrat", sans-serif;'>🌍 Total Footprint</h3>
-            <p style='font-size:28px; font-weight:bold; color:#d32f2f;'>{results['Total']} tonnes CO₂/year</p>
-        </div>
-    """, unsafe_allow_html=True)
+    st.markdown(_TOTAL_CARD_TMPL.format(total=results['Total']), unsafe_allow_html=True)
 
     # --- Emission Level Classification ---
     if total < 2.0:
@@ -660,8 +873,8 @@ else:
         "Reduce, reuse, recycle, and inspire others to join you on the journey to lower carbon emissions. Together, we can make a difference."
     )
 
-    # --- PDF Download (fixed: always return bytes for Streamlit) ---
-    def make_pdf(results_dict, username):
+    # --- PDF Download ---
+    def make_pdf(results_dict, ordered, username, generated):
         def to_latin1(s):
             try:
                 return str(s).encode("latin-1", "replace").decode("latin-1")
@@ -680,9 +893,8 @@ else:
         pdf.set_font("Helvetica", "B", 20)
         pdf.cell(0, 10, to_latin1("Footprint Buddy - Carbon Footprint Report"), ln=1)
         pdf.set_font("Helvetica", size=12)
-        dt = datetime.now().strftime("%Y-%m-%d %H:%M")
         pdf.cell(0, 8, to_latin1(f"User: {username}"), ln=1)
-        pdf.cell(0, 8, to_latin1(f"Generated: {dt}"), ln=1)
+        pdf.cell(0, 8, to_latin1(f"Generated: {generated}"), ln=1)
         pdf.ln(4)
 
         # Total and classification
@@ -711,17 +923,18 @@ else:
         pdf.ln(2)
 
         # Breakdown table
+        cats = EMISSION_CATEGORIES
+        values = [f"{v:.2f}" for v in ordered]
         col1_w = epw * 0.6
         col2_w = epw * 0.4
         pdf.set_font("Helvetica", "B", 12)
         pdf.cell(col1_w, 8, to_latin1("Category"), border=1)
         pdf.cell(col2_w, 8, to_latin1("Tonnes CO2/year"), border=1, ln=1)
         pdf.set_font("Helvetica", "", 11)
-
-        cats = ["Commute", "Flight", "Electricity", "Cooking Fuel", "Diet", "Water", "Waste", "Streaming"]
-        for cat in cats:
+        # Plain cells: fpdf2's table() lays out every cell via multi_cell and measured slower here
+        for cat, val in zip(cats, values):
             pdf.cell(col1_w, 8, to_latin1(cat), border=1)
-            pdf.cell(col2_w, 8, to_latin1(f"{results_dict.get(cat, 0.0):.2f}"), border=1, ln=1)
+            pdf.cell(col2_w, 8, to_latin1(val), border=1, ln=1)
 
         # Inputs summary
         pdf.ln(4)
@@ -731,49 +944,56 @@ else:
 
         d = results_dict.get("Details", {})
 
-        def add_kv(k, v):
-            pdf.set_x(pdf.l_margin)
-            pdf.multi_cell(epw, 6, to_latin1(f"{k}: {v}"))
-
-        add_kv("Commute Mode", d.get("Commute Mode", ""))
-        add_kv("Commute Days/Week", d.get("Commute Days/Week", ""))
-        add_kv("Carpooling", d.get("Carpooling", ""))
-        add_kv("Short Flights", d.get("Short Flights", ""))
-        add_kv("Long Flights", d.get("Long Flights", ""))
-        add_kv("Flight Class", d.get("Flight Class", ""))
-        add_kv("Electricity Source", d.get("Electricity Source", ""))
-        add_kv("Household Size", d.get("Household Size", ""))
-        add_kv("Cooking Fuel Type", d.get("Cooking Fuel Type", ""))
-        add_kv("Cooking People", d.get("Cooking People", ""))
-        add_kv("Efficient Stove", d.get("Efficient Stove", ""))
-        add_kv("Diet Type", d.get("Diet Type", ""))
-        add_kv("Eating Out (meals/week)", d.get("Eating Out", ""))
-        add_kv("Water Saving", d.get("Water Saving", ""))
-        add_kv("Water Source", d.get("Water Source", ""))
-        add_kv("Recycling %", d.get("Recycling %", ""))
-        add_kv("Waste Types", ", ".join(d.get("Waste Types", [])))
-        add_kv("Streaming Device", d.get("Streaming Device", ""))
+        summary_items = [
+            ("Commute Mode", d.get("Commute Mode", "")),
+            ("Commute Days/Week", d.get("Commute Days/Week", "")),
+            ("Carpooling", d.get("Carpooling", "")),
+            ("Short Flights", d.get("Short Flights", "")),
+            ("Long Flights", d.get("Long Flights", "")),
+            ("Flight Class", d.get("Flight Class", "")),
+            ("Electricity Source", d.get("Electricity Source", "")),
+            ("Household Size", d.get("Household Size", "")),
+            ("Cooking Fuel Type", d.get("Cooking Fuel Type", "")),
+            ("Cooking People", d.get("Cooking People", "")),
+            ("Efficient Stove", d.get("Efficient Stove", "")),
+            ("Diet Type", d.get("Diet Type", "")),
+            ("Eating Out (meals/week)", d.get("Eating Out", "")),
+            ("Water Saving", d.get("Water Saving", "")),
+            ("Water Source", d.get("Water Source", "")),
+            ("Recycling %", d.get("Recycling %", "")),
+            ("Waste Types", ", ".join(d.get("Waste Types", []))),
+            ("Streaming Device", d.get("Streaming Device", "")),
+        ]
+        # One multi_cell for the whole block instead of one per line
+        pdf.set_x(pdf.l_margin)
+        pdf.multi_cell(epw, 6, to_latin1("\n".join(f"{k}: {v}" for k, v in summary_items)))
 
         pdf.ln(2)
         pdf.set_font("Helvetica", "I", 10)
         pdf.set_x(pdf.l_margin)
         pdf.multi_cell(epw, 5, to_latin1("Note: Streaming emissions include only network and datacenter. Household electricity is apportioned per person. Cooking electricity is subtracted from household electricity to avoid double counting."))
 
-        out = pdf.output(dest="S")
-        # Normalize to pure bytes for Streamlit
-        if isinstance(out, bytes):
-            return out
-        if isinstance(out, bytearray):
-            return bytes(out)
-        # PyFPDF compatibility (returns str)
-        return out.encode("latin-1", "replace")
+        # fpdf2 builds the document in a bytearray; Streamlit wants bytes
+        return bytes(pdf.output())
 
     if FPDF_AVAILABLE:
-        pdf_bytes = make_pdf(results, st.session_state.current_user)
+        # Reuse the rendered PDF across reruns until the results, user or minute change;
+        # the minute is in the key so the "Generated" line always matches the file name
+        now = datetime.now()
+        generated = now.strftime("%Y-%m-%d %H:%M")
+        pdf_key = hashlib.sha256(
+            json.dumps([st.session_state.current_user, generated, results], sort_keys=True, default=str).encode()
+        ).hexdigest()
+        cached = st.session_state.get("_pdf_cache")
+        if cached and cached[0] == pdf_key:
+            pdf_bytes = cached[1]
+        else:
+            pdf_bytes = make_pdf(results, st.session_state.results_ordered, st.session_state.current_user, generated)
+            st.session_state._pdf_cache = (pdf_key, pdf_bytes)
         st.download_button(
             label="📄 Download PDF Report",
             data=pdf_bytes,
-            file_name=f"Footprint_Buddy_{st.session_state.current_user}_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf",
+            file_name=f"Footprint_Buddy_{st.session_state.current_user}_{now.strftime('%Y%m%d_%H%M')}.pdf",
             mime="application/pdf"
         )
     else: